@@ -0,0 +1,201 @@
+"""
+Stand-ins for the parts of discord.py the cogs touch, so they can be driven without a gateway connection.
+REST calls sleep for a configurable latency instead of going over the network.
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import discord
+
+from utils.metrics import Metrics
+from utils.outbound import Outbound
+
+
+_snowflakes = itertools.count(1_100_000_000_000_000_000)
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+class FakeREST:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeReaction:
+    def __init__(self, emoji, count):
+        self.emoji = emoji
+        self.count = count
+
+
+class FakeMessage:
+    def __init__(self, channel, id, embed=None):
+        self.channel = channel
+        self.id = id
+        self.embeds = [embed or discord.Embed(title=f"Topic {id}", description="seeded topic")]
+        self.reactions = [FakeReaction("👍", 1)]
+
+    async def add_reaction(self, emoji):
+        await self.channel.rest.call()
+
+    async def edit(self, *, embed=None, **kwargs):
+        await self.channel.rest.call()
+        if embed is not None:
+            self.embeds = [embed]
+        return self
+
+    async def fetch(self):
+        await self.channel.rest.call()
+        return self
+
+
+class FakeChannel:
+    def __init__(self, guild, id, rest):
+        self.guild = guild
+        self.id = id
+        self.rest = rest
+        self.messages = {}
+
+    def _message(self, message_id):
+        if message_id not in self.messages:
+            self.messages[message_id] = FakeMessage(self, message_id)
+        return self.messages[message_id]
+
+    async def send(self, *, embed=None, **kwargs):
+        await self.rest.call()
+        message = FakeMessage(self, snowflake(), embed)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return self._message(message_id)
+
+    async def fetch_message(self, message_id):
+        await self.rest.call()
+        return self._message(message_id)
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+
+class FakeRole:
+    def __init__(self, id):
+        self.id = id
+        self.name = f"role-{id}"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, id, rest):
+        self.id = id
+        self.name = f"guild-{id}"
+        self.channels = {}
+        self.roles = {}
+        self.rest = rest
+
+    def add_channel(self):
+        channel = FakeChannel(self, snowflake(), self.rest)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_role(self):
+        role = FakeRole(snowflake())
+        self.roles[role.id] = role
+        return role
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    def get_role(self, id):
+        return self.roles.get(id)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, *, view=None, **kwargs):
+        await self.interaction.client.rest.call()
+        if view is not None and hasattr(view, "yes_button"):
+            # confirm straight away, as if the user clicked Yes
+            view.result = True
+            view.stop()
+
+    async def edit_message(self, **kwargs):
+        await self.interaction.client.rest.call()
+
+    async def defer(self, **kwargs):
+        await self.interaction.client.rest.call()
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.client.rest.call()
+
+
+class FakeInteraction:
+    def __init__(self, bot, guild):
+        self.client = bot
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = SimpleNamespace(id=snowflake())
+        self.extras = {}
+        self.command = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.client.rest.call()
+
+
+class FakeBot:
+    """The attributes of StaffToDoList the cogs and SQLDB use"""
+
+    def __init__(self, config, rest_latency: float = 0.0):
+        self.config = config
+        self.metrics = Metrics()
+        self.outbound = Outbound(self.metrics, config.outbound_concurrency)
+        self.rest = FakeREST(rest_latency)
+        self.user = SimpleNamespace(id=snowflake(), name="bench")
+        self.guilds = {}
+        self.db = None
+
+    def add_guild(self):
+        guild = FakeGuild(snowflake(), self.rest)
+        self.guilds[guild.id] = guild
+        return guild
+
+    def get_guild(self, id):
+        return self.guilds.get(id)
+
+    def get_channel(self, id):
+        for guild in self.guilds.values():
+            if id in guild.channels:
+                return guild.channels[id]
+        return None
+
+    def is_ready(self):
+        return True
+
+    def dispatch(self, event, *args):
+        pass
+
+
+def reaction_payload(guild_id, channel_id, message_id, user_id, add=True):
+    return SimpleNamespace(
+        emoji=SimpleNamespace(name="👍"), guild_id=guild_id, channel_id=channel_id, message_id=message_id,
+        user_id=user_id, member=None, event_type="REACTION_ADD" if add else "REACTION_REMOVE")
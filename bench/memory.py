@@ -0,0 +1,102 @@
+"""
+Compares process memory after joining synthetic guilds under each cache profile.
+
+Usage: python -m bench.memory [--guilds 20] [--members 5000] [--output results.jsonl]
+
+Every profile runs in its own interpreter. Guild payloads are fed straight into the client's connection state,
+shaped like the GUILD_CREATE (plus member chunks) Discord would send for the profile's intents: members and
+presences are only included when the members intent is requested.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import subprocess
+import sys
+
+import discord
+
+from main import client_options
+from utils.config import CACHE_PROFILES
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * 4096
+
+
+def guild_payload(guild_id, members, with_members):
+    data = {
+        "id": str(guild_id), "name": f"guild-{guild_id}", "owner_id": "1", "member_count": members,
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(guild_id + 1), "type": 0, "name": "topics", "position": 0, "permission_overwrites": []}],
+        "emojis": [], "stickers": [], "features": [], "threads": [], "stage_instances": [],
+        "guild_scheduled_events": [], "voice_states": [], "large": True,
+    }
+    if with_members:
+        data["members"] = [
+            {"user": {"id": str(guild_id * 100_000 + i), "username": f"user{i}", "discriminator": "0",
+                      "global_name": f"User {i}", "avatar": None},
+             "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+            for i in range(members)]
+        data["presences"] = [
+            {"user": {"id": str(guild_id * 100_000 + i)}, "status": "online", "activities": [],
+             "client_status": {"desktop": "online"}}
+            for i in range(0, members, 3)]
+    return data
+
+
+async def measure_profile(profile, guilds, members):
+    options = client_options(profile)
+    client = discord.Client(**options)
+    state = client._connection
+    with_members = options["intents"].members
+    gc.collect()
+    before = rss_bytes()
+    for n in range(guilds):
+        guild_id = 1_000_000 + n * 10
+        # the same path the gateway's GUILD_CREATE handler takes, minus the chunk requests
+        state._add_guild_from_data(guild_payload(guild_id, members, with_members))
+    gc.collect()
+    after = rss_bytes()
+    return {
+        "profile": profile,
+        "guilds": guilds,
+        "members_per_guild": members,
+        "cached_members": sum(len(g.members) for g in client.guilds),
+        "rss_before_mb": round(before / 2**20, 1),
+        "rss_after_mb": round(after / 2**20, 1),
+        "rss_delta_mb": round((after - before) / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5000, help="members per guild")
+    parser.add_argument("--profile", choices=CACHE_PROFILES, help="measure only this profile in this process")
+    parser.add_argument("--output", help="append JSON lines to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(asyncio.run(measure_profile(args.profile, args.guilds, args.members))))
+        return
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for profile in CACHE_PROFILES:
+            result = subprocess.run(
+                [sys.executable, "-m", "bench.memory", "--profile", profile,
+                 "--guilds", str(args.guilds), "--members", str(args.members)],
+                capture_output=True, text=True, check=True)
+            output.write(result.stdout)
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils.outbound import BACKGROUND
+
+
+console_logger = logging.getLogger("main")
+
+
+class Board(commands.Cog):
+    """Keeps a pinned, ranked list of open topics in the output channel"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        # guild_id -> {message_id: topic} for every guild with a board, kept up to date from SQLDB's topic events
+        self.rankings = {}
+        # message_id -> guild_id and topic id -> message_id, to route events that only carry one of them
+        self.topic_guilds = {}
+        self.topic_messages = {}
+        # (guild_id, [(event, args)]) for every ranking being loaded, see load_ranking
+        self.reloads = []
+        self.render_tasks = {}
+        self.last_render = {}
+        self.last_embed = {}
+
+    board = app_commands.Group(name="board", description="Configures the pinned priority board",
+                               guild_only=True, default_permissions=discord.Permissions(administrator=True))
+
+    async def cog_unload(self):
+        for task in self.render_tasks.values():
+            task.cancel()
+
+    async def load_ranking(self, guild_id):
+        # later increments are applied on top of what is loaded here, so it must include the buffered ones
+        await self.bot.db.priority_flush()
+        # events during the query may be missing from its result, they are replayed once it is installed
+        reload = (guild_id, [])
+        self.reloads.append(reload)
+        try:
+            rows = await self.bot.db.message_get_ranking(guild_id)
+        finally:
+            self.reloads.remove(reload)
+        self.drop_ranking(guild_id)
+        topics = {r['message_id']: dict(r) for r in rows}
+        self.rankings[guild_id] = topics
+        for topic in topics.values():
+            self.topic_guilds[topic['message_id']] = guild_id
+            self.topic_messages[topic['id']] = topic['message_id']
+        for event, args in reload[1]:
+            if event == "priorities":
+                self.apply_priorities(args, guild_id)
+            elif event == "add" and args[0] == guild_id:
+                self.add_topic(*args)
+            elif event == "close":
+                self.close_topic(args, guild_id)
+
+    def drop_ranking(self, guild_id):
+        for topic in self.rankings.pop(guild_id, {}).values():
+            self.topic_guilds.pop(topic['message_id'], None)
+            self.topic_messages.pop(topic['id'], None)
+        self.last_embed.pop(guild_id, None)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        for guild_id in self.bot.db.guild_get_boards():
+            # the settings cache holds every guild, including those served by other shard processes
+            if not self.bot.get_guild(guild_id):
+                continue
+            await self.load_ranking(guild_id)
+            self.schedule_render(guild_id)
+
+    @commands.Cog.listener()
+    async def on_settings_invalidated(self, guild_id):
+        """Picks up boards enabled or disabled by another process"""
+        guild_ids = [guild_id] if guild_id else set(self.rankings) | set(self.bot.db.guild_get_boards())
+        for guild_id in guild_ids:
+            if not self.bot.get_guild(guild_id):
+                continue
+            if await self.bot.db.guild_board_get(guild_id):
+                await self.load_ranking(guild_id)
+                self.schedule_render(guild_id)
+            else:
+                self.drop_ranking(guild_id)
+
+    def record(self, event, args):
+        for _, events in self.reloads:
+            events.append((event, args))
+
+    @commands.Cog.listener()
+    async def on_topic_priorities(self, changes):
+        self.record("priorities", changes)
+        self.apply_priorities(changes)
+
+    @commands.Cog.listener()
+    async def on_topic_add(self, guild_id, topic):
+        self.record("add", (guild_id, topic))
+        self.add_topic(guild_id, topic)
+
+    @commands.Cog.listener()
+    async def on_topic_close(self, topic_id):
+        self.record("close", topic_id)
+        self.close_topic(topic_id)
+
+    def apply_priorities(self, changes, only_guild=None):
+        changed = set()
+        for message_id, (absolute, value) in changes.items():
+            guild_id = self.topic_guilds.get(message_id)
+            if guild_id is None or only_guild not in (None, guild_id):
+                continue
+            topic = self.rankings[guild_id][message_id]
+            topic['priority_level'] = value if absolute else topic['priority_level'] + value
+            changed.add(guild_id)
+        for guild_id in changed:
+            self.schedule_render(guild_id)
+
+    def add_topic(self, guild_id, topic):
+        if guild_id not in self.rankings:
+            return
+        self.rankings[guild_id][topic['message_id']] = dict(topic)
+        self.topic_guilds[topic['message_id']] = guild_id
+        self.topic_messages[topic['id']] = topic['message_id']
+        self.schedule_render(guild_id)
+
+    def close_topic(self, topic_id, only_guild=None):
+        message_id = self.topic_messages.get(topic_id)
+        guild_id = self.topic_guilds.get(message_id)
+        if guild_id is None or only_guild not in (None, guild_id):
+            return
+        del self.topic_messages[topic_id]
+        del self.topic_guilds[message_id]
+        self.rankings[guild_id].pop(message_id, None)
+        self.schedule_render(guild_id)
+
+    def schedule_render(self, guild_id):
+        """Renders the board once the minimum interval since the last render has passed, merging changes in between"""
+        if guild_id not in self.render_tasks:
+            self.render_tasks[guild_id] = asyncio.create_task(self.render_later(guild_id))
+
+    async def render_later(self, guild_id):
+        try:
+            wait = self.last_render.get(guild_id, 0) + self.bot.config.board_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            # changes from here on schedule another render
+            self.render_tasks.pop(guild_id, None)
+        try:
+            await self.render(guild_id)
+        except Exception:
+            console_logger.exception(f"Failed to render the priority board for guild {guild_id}")
+
+    def build_embed(self, guild, channel_id, topics):
+        embed = discord.Embed(title=f"Priority board for {guild.name}", color=discord.Color.orange())
+        ranked = sorted(topics, key=lambda t: (t['priority_level'], t['id']), reverse=True)
+        for todo in ranked[:self.bot.config.board_size]:
+            title = todo['title'][0:20] + "..." if len(todo['title']) > 20 else todo['title']
+            link = f"https://discord.com/channels/{guild.id}/{channel_id}/{todo['message_id']}"
+            embed.add_field(name=f"ID: {todo['id']} Priority Level: {todo['priority_level']}",
+                            value=f"Title: {title}\nLink to post: {link}", inline=False)
+        if not ranked:
+            embed.description = "No open topics!"
+        elif len(ranked) > self.bot.config.board_size:
+            embed.set_footer(text=f"{len(ranked) - self.bot.config.board_size} more open topics, see /listopen")
+        return embed
+
+    async def render(self, guild_id):
+        guild = self.bot.get_guild(guild_id)
+        settings = await self.bot.db.guild_get_all(guild_id)
+        if not guild or guild_id not in self.rankings or not settings or not settings.get('board_message_id'):
+            return
+        channel = guild.get_channel(settings['output_channel_id']) if settings['output_channel_id'] else None
+        if not channel:
+            return
+        self.last_render[guild_id] = time.monotonic()
+        embed = self.build_embed(guild, channel.id, self.rankings[guild_id].values())
+        # changes below the visible part of the board do not need an edit
+        if embed.to_dict() == self.last_embed.get(guild_id):
+            return
+        self.last_embed[guild_id] = embed.to_dict()
+        try:
+            await self.bot.outbound.edit(channel.get_partial_message(settings['board_message_id']), BACKGROUND, embed=embed)
+        except discord.NotFound:
+            console_logger.info(f"Priority board message in guild {guild_id} was deleted, disabling the board")
+            await self.bot.db.guild_board_set(guild_id, None)
+            self.drop_ranking(guild_id)
+
+    @board.command(name="enable")
+    async def board_enable(self, interaction: discord.Interaction):
+        """Posts and pins a priority board in the output channel"""
+        guild = interaction.guild
+        data = await self.bot.db.guild_get_all(guild.id)
+        if not data or not data['output_channel_id'] or not guild.get_channel(data['output_channel_id']):
+            return await interaction.response.send_message("Set an output channel first with `/channel set`", ephemeral=True)
+        if data.get('board_message_id'):
+            return await interaction.response.send_message("The priority board is already enabled", ephemeral=True)
+
+        channel = guild.get_channel(data['output_channel_id'])
+        await interaction.response.defer(ephemeral=True)
+        await self.load_ranking(guild.id)
+        embed = self.build_embed(guild, channel.id, self.rankings[guild.id].values())
+        message = await self.bot.outbound.send(channel, embed=embed)
+        await self.bot.db.guild_board_set(guild.id, message.id)
+        self.last_embed[guild.id] = embed.to_dict()
+        self.last_render[guild.id] = time.monotonic()
+        try:
+            await message.pin()
+        except discord.HTTPException:
+            return await interaction.followup.send("Priority board posted, but it could not be pinned", ephemeral=True)
+        await interaction.followup.send(f"Priority board posted in {channel.mention}", ephemeral=True)
+
+    @board.command(name="disable")
+    async def board_disable(self, interaction: discord.Interaction):
+        """Removes the priority board"""
+        guild = interaction.guild
+        data = await self.bot.db.guild_get_all(guild.id)
+        if not data or not data.get('board_message_id'):
+            return await interaction.response.send_message("The priority board is not enabled", ephemeral=True)
+
+        await self.bot.db.guild_board_set(guild.id, None)
+        self.drop_ranking(guild.id)
+        channel = guild.get_channel(data['output_channel_id']) if data['output_channel_id'] else None
+        if channel:
+            try:
+                await channel.get_partial_message(data['board_message_id']).delete()
+            except discord.HTTPException:
+                pass
+        await interaction.response.send_message("Priority board removed", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Board(bot))
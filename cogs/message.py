@@ -1,8 +1,33 @@
+import asyncio
+import logging
+import time
+
 import discord
 from discord import app_commands
 from discord.app_commands import Choice
-from discord.ext import commands
-from utils.menu import YesNoView
+from discord.ext import commands, tasks
+from utils.menu import PageView, YesNoView
+from utils.outbound import BACKGROUND, INTERACTIVE
+
+
+console_logger = logging.getLogger("main")
+
+TOPICS_PER_PAGE = 10
+MAX_BULK_CLOSE = 100
+
+
+def parse_topic_ids(text: str) -> list:
+    """Parses topic numbers like "3, 5-8 12" into a sorted list of ids"""
+    ids = set()
+    for part in text.replace(",", " ").split():
+        start, _, end = part.partition("-")
+        if not start.isdigit() or (end and not end.isdigit()):
+            raise ValueError(part)
+        first, last = int(start), int(end or start)
+        if last < first or last - first >= MAX_BULK_CLOSE:
+            raise ValueError(part)
+        ids.update(range(first, last + 1))
+    return sorted(ids)
 
 
 class Message(commands.Cog):
@@ -10,36 +35,175 @@ class Message(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # message_id -> channel_id of messages whose count was changed incrementally since the last reconciliation
+        self.dirty_messages = {}
+        self.startup_task = None
+        # guild_id -> message_ids that got a live reaction event while the guild's history is being reconciled
+        self.reconcile_touched = {}
+        self.reconcile_progress = {"guilds_total": 0, "guilds_done": 0, "messages_scanned": 0, "corrected": 0}
+        bot.metrics.gauge("startup_reconcile", "Progress of the reconciliation of reactions missed while offline",
+                          lambda: {(("kind", k),): v for k, v in self.reconcile_progress.items()})
+
+    @property
+    def incremental_reactions(self):
+        return self.bot.config.incremental_reactions
+
+    async def cog_load(self):
+        self.start_reconcile()
+
+    def start_reconcile(self):
+        self.reconcile_reactions.change_interval(seconds=self.bot.config.reaction_reconcile_interval)
+        if self.incremental_reactions and not self.reconcile_reactions.is_running():
+            self.reconcile_reactions.start()
+
+    @commands.Cog.listener()
+    async def on_config_reload(self, old_config, new_config):
+        self.start_reconcile()
+
+    async def cog_unload(self):
+        self.reconcile_reactions.cancel()
+        if self.startup_task:
+            self.startup_task.cancel()
+
+    @staticmethod
+    def count_reactions(message: discord.Message) -> int:
+        return next((r.count for r in message.reactions if r.emoji == "👍"), 0)
+
+    @tasks.loop(seconds=300)
+    async def reconcile_reactions(self):
+        """Corrects any drift left by incremental counting, only for messages that were reacted to"""
+        dirty, self.dirty_messages = self.dirty_messages, {}
+        for message_id, channel_id in dirty.items():
+            channel = self.bot.get_channel(channel_id)
+            if not channel:
+                continue
+            try:
+                message = await self.bot.outbound.fetch_message(channel, message_id, BACKGROUND)
+            except discord.NotFound:
+                continue
+            except discord.HTTPException:
+                # try again on the next run
+                self.dirty_messages.setdefault(message_id, channel_id)
+                continue
+            await self.bot.db.message_update(message_id, self.count_reactions(message))
+
+    @reconcile_reactions.before_loop
+    async def before_reconcile_reactions(self):
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.bot.config.startup_reconcile and (not self.startup_task or self.startup_task.done()):
+            self.startup_task = asyncio.create_task(self.reconcile_missed_reactions())
+
+    async def reconcile_missed_reactions(self):
+        """Recounts every open topic from the output channels' history, for reactions missed while offline"""
+        guilds = list(self.bot.guilds)
+        self.reconcile_progress = {"guilds_total": len(guilds), "guilds_done": 0, "messages_scanned": 0, "corrected": 0}
+        semaphore = asyncio.Semaphore(self.bot.config.startup_reconcile_concurrency)
+        start = time.perf_counter()
+
+        async def run(guild):
+            async with semaphore:
+                try:
+                    await self.reconcile_guild(guild)
+                except Exception:
+                    console_logger.exception(f"Failed to reconcile reactions in {guild.name} ({guild.id})")
+                self.reconcile_progress["guilds_done"] += 1
+
+        await asyncio.gather(*(run(guild) for guild in guilds))
+        console_logger.info(
+            f"Reaction reconciliation finished in {time.perf_counter() - start:.1f}s: "
+            f"{self.reconcile_progress['guilds_done']} guilds, {self.reconcile_progress['messages_scanned']} messages scanned, "
+            f"{self.reconcile_progress['corrected']} topics corrected")
+
+    async def reconcile_guild(self, guild):
+        channel_id = await self.bot.db.guild_channel_get(guild.id)
+        channel = guild.get_channel(channel_id) if channel_id else None
+        if not channel:
+            return
+        touched = self.reconcile_touched[guild.id] = set()
+        try:
+            await self._reconcile_guild(guild, channel, touched)
+        finally:
+            del self.reconcile_touched[guild.id]
+
+    async def _reconcile_guild(self, guild, channel, touched):
+        # buffered increments are not in the database yet, the stored counts would be stale without them
+        await self.bot.db.priority_flush()
+        stored = {r['message_id']: r['priority_level'] for r in await self.bot.db.message_get_priorities(guild.id)}
+        if not stored:
+            return
+
+        remaining = set(stored)
+        corrections = {}
+        scanned = 0
+        delay = self.bot.config.startup_reconcile_page_delay
+        # history is fetched 100 messages per request, starting at the oldest open topic
+        async for message in channel.history(limit=None, after=discord.Object(id=min(stored) - 1)):
+            scanned += 1
+            self.reconcile_progress["messages_scanned"] += 1
+            if message.id in remaining:
+                remaining.discard(message.id)
+                count = self.count_reactions(message)
+                if count != stored[message.id]:
+                    corrections[message.id] = count
+                if not remaining:
+                    break
+            if delay and scanned % 100 == 0:
+                await asyncio.sleep(delay)
+
+        # a live event since the walk started already wrote a newer count, or queued a delta on top of the stored one
+        for message_id in touched:
+            corrections.pop(message_id, None)
+        if corrections:
+            await self.bot.db.message_update_many(corrections)
+            self.reconcile_progress["corrected"] += len(corrections)
+        console_logger.info(
+            f"Reconciled reactions in {guild.name}: {scanned} messages scanned, {len(stored) - len(remaining)}/{len(stored)} "
+            f"topics found, {len(corrections)} corrected "
+            f"({self.reconcile_progress['guilds_done'] + 1}/{self.reconcile_progress['guilds_total']} guilds)")
 
     def construct_message_link(self, guild_id: int, channel_id: int, message_id: int):
         return f"https://discord.com/channels/{guild_id}/{channel_id}/{message_id}"
 
     async def react_check(self, payload):
         """Checks reaction for a thumbs up"""
-        if payload.member and payload.member.id == self.bot.user.id:
+        # Everything up to the channel check is answered from memory, so unrelated reactions cost no I/O
+        if payload.emoji.name != "👍" or not payload.guild_id:
             return
-        guild = self.bot.get_guild(payload.guild_id)
-        if not guild:
+        if payload.user_id == self.bot.user.id:
             return
-        output_channel_id = await self.bot.db.guild_channel_get(guild.id)
-        channel = guild.get_channel(output_channel_id)
+        output_channel_id = await self.bot.db.guild_channel_get(payload.guild_id)
         if payload.channel_id != output_channel_id:
             return
+        if payload.guild_id in self.reconcile_touched:
+            self.reconcile_touched[payload.guild_id].add(payload.message_id)
 
-        if payload.emoji.name == "👍":
-            message = await channel.get_partial_message(payload.message_id).fetch()
-            plus_one = [r for r in message.reactions if r.emoji == "👍"][0]
-            await self.bot.db.message_update(payload.message_id, plus_one.count)
+        if self.incremental_reactions:
+            delta = 1 if payload.event_type == "REACTION_ADD" else -1
+            await self.bot.db.message_increment(payload.message_id, delta)
+            self.dirty_messages[payload.message_id] = payload.channel_id
+            return
+
+        guild = self.bot.get_guild(payload.guild_id)
+        if not guild:
+            return
+        channel = guild.get_channel(output_channel_id)
+        message = await self.bot.outbound.fetch_message(channel, payload.message_id, BACKGROUND)
+        await self.bot.db.message_update(payload.message_id, self.count_reactions(message))
 
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload):
         """Update priority count"""
-        await self.react_check(payload)
+        with self.bot.metrics.time("reaction_seconds", event="add"):
+            await self.react_check(payload)
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload):
         """Update priority count"""
-        await self.react_check(payload)
+        with self.bot.metrics.time("reaction_seconds", event="remove"):
+            await self.react_check(payload)
 
     @app_commands.guild_only()
     @app_commands.command()
@@ -73,13 +237,33 @@ class Message(commands.Cog):
         await view.wait()
         if not view.result:
             return await interaction.edit_original_response(content="Cancelled", view=None)
-        posted_message = await channel.send(embed=embed)
-        await posted_message.add_reaction("\U0001f44d")
-        await self.bot.db.message_add(guild.id, title, message, posted_message.id)
-        db_msg = await self.bot.db.message_get_by_message(posted_message.id)
-        embed.title = f"Topic #{db_msg['id']}: {title}"
-        await posted_message.edit(embed=embed)
+        # The topic number is reserved up front so the embed is posted with its final title
+        start = time.perf_counter()
+        topic_id = await self.bot.db.message_reserve_id()
+        reserved = time.perf_counter()
+        embed.title = f"Topic #{topic_id}: {title}"
+        posted_message = await self.bot.outbound.send(channel, INTERACTIVE, embed=embed)
+        posted = time.perf_counter()
+        await asyncio.gather(self.bot.outbound.add_reaction(posted_message, "\U0001f44d", INTERACTIVE),
+                             self.bot.db.message_add(guild.id, title, message, posted_message.id, topic_id))
+        stored = time.perf_counter()
         await interaction.edit_original_response(content=f"Topic submitted to {guild.name}", view=None)
+        done = time.perf_counter()
+        for stage, seconds in (("reserve", reserved - start), ("post", posted - reserved),
+                               ("react+store", stored - posted), ("respond", done - stored)):
+            self.bot.metrics.observe("send_stage_seconds", seconds, stage=stage)
+
+    def resolve_embed(self, embed: discord.Embed, outcome: str, reason: str) -> discord.Embed:
+        """Marks a topic embed as closed"""
+        desc = "~~" + embed.description + "~~"
+        embed.description = desc
+        embed.add_field(name="Resolved",
+                        value=f"This topic has been resolved by administrators for the following reason:\n```{reason}```")
+        if outcome.lower() == "accept":
+            embed.color = discord.Color.green()
+        else:
+            embed.color = discord.Color.red()
+        return embed
 
     @app_commands.guild_only()
     @app_commands.choices(
@@ -113,49 +297,165 @@ class Message(commands.Cog):
         if not outcome.lower() in ('accept', 'deny'):
             return await interaction.response.send_message("Please specify if you are accepting or denying this suggestion", ephemeral=True)
 
+        # the fetch and edit wait in the outbound queue, which can take longer than Discord waits for a response
+        await interaction.response.defer(ephemeral=True)
         db_msg = await self.bot.db.message_get_by_id(topic)
         channel = guild.get_channel(data['output_channel_id'])
-        message = await channel.fetch_message(db_msg['message_id'])
+        message = await self.bot.outbound.fetch_message(channel, db_msg['message_id'], INTERACTIVE)
 
-        embed = message.embeds[0]
-        desc = "~~" + embed.description + "~~"
-        embed.description = desc
-        embed.add_field(name="Resolved",
-                        value=f"This topic has been resolved by administrators for the following reason:\n```{reason}```")
-        if outcome.lower() == "accept":
-            embed.color = discord.Color.green()
-        else:
-            embed.color = discord.Color.red()
+        embed = self.resolve_embed(message.embeds[0], outcome, reason)
+        await self.bot.outbound.edit(message, INTERACTIVE, embed=embed)
+        await self.bot.db.message_archive(db_msg['id'], outcome.lower(), reason, interaction.user.id)
+        await interaction.followup.send(f"Closed topic id {db_msg['id']}", ephemeral=True)
+
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.choices(
+        outcome=[
+            Choice(name='Accepted', value='accept',),
+            Choice(name='Denied', value='deny'),
+        ]
+    )
+    @app_commands.command(name="closemany")
+    async def close_many(self,
+                         interaction: discord.Interaction,
+                         topics: str,
+                         outcome: str,
+                         reason: str):
+        """
+        Closes several topics at once requires administrator perms
 
-        await message.edit(embed=embed)
-        await self.bot.db.message_remove(db_msg['id'])
-        await interaction.response.send_message(f"Closed topic id {db_msg['id']}", ephemeral=True)
+        Args:
+            topics: Topic numbers and ranges, like 3, 5-8, 12
+            outcome: Decision made by administrators (Accepted, Denied)
+            reason: The reason behind the outcome
+        """
+        guild = interaction.guild
+        data = await self.bot.db.guild_get_all(guild.id)
+        if not data or not data['output_channel_id'] or not guild.get_channel(data['output_channel_id']):
+            return await interaction.response.send_message(f"Bot is not configured for {guild.name}. Please contact and admin!", ephemeral=True)
+
+        if not outcome.lower() in ('accept', 'deny'):
+            return await interaction.response.send_message("Please specify if you are accepting or denying this suggestion", ephemeral=True)
+
+        try:
+            ids = parse_topic_ids(topics)
+        except ValueError as e:
+            return await interaction.response.send_message(f"Could not read `{e}`, use numbers and ranges like `3, 5-8, 12`", ephemeral=True)
+        if not ids or len(ids) > MAX_BULK_CLOSE:
+            return await interaction.response.send_message(f"Please give between 1 and {MAX_BULK_CLOSE} topics", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        rows = {r['id']: r for r in await self.bot.db.message_get_by_ids(guild.id, ids)}
+        closed = await self.bot.db.message_archive_many(guild.id, list(rows), outcome.lower(), reason, interaction.user.id)
+        missing = [id for id in ids if id not in closed]
+
+        # The embeds are rebuilt from the stored topic, so the old message does not have to be fetched first.
+        # Every post is in the output channel, so the outbound queue bounds how many edits are in flight at once.
+        channel = guild.get_channel(data['output_channel_id'])
+        failed = []
+
+        async def edit(id):
+            row = rows[id]
+            embed = discord.Embed(title=f"Topic #{id}: {row['title']}", description=row['message'], color=discord.Color.gold())
+            try:
+                await self.bot.outbound.edit(channel.get_partial_message(row['message_id']), INTERACTIVE,
+                                             embed=self.resolve_embed(embed, outcome, reason))
+            except discord.HTTPException:
+                failed.append(id)
+
+        await asyncio.gather(*(edit(id) for id in closed))
+
+        summary = f"Closed {len(closed)} topics: {', '.join(map(str, sorted(closed))) or 'none'}"
+        if missing:
+            summary += f"\nNot found or already closed: {', '.join(map(str, missing))}"
+        if failed:
+            summary += f"\nClosed, but the post could not be updated: {', '.join(map(str, sorted(failed)))}"
+        await interaction.followup.send(summary[:2000], ephemeral=True)
 
     @app_commands.guild_only()
     @app_commands.command(name="listopen")
     async def list_open(self, interaction: discord.Interaction):
         """List current issues that are on the table"""
-        active_todo_list = await self.bot.db.message_get_all(interaction.guild_id)
-        guild_channel = await self.bot.db.guild_channel_get(interaction.guild.id)
-        embed = discord.Embed(title=f"On going issues and suggestions for {interaction.guild.name}",
-                              color=discord.Color.orange())
-        if active_todo_list:
-            for todo in active_todo_list:
+        guild = interaction.guild
+        guild_channel = await self.bot.db.guild_channel_get(guild.id)
+
+        async def fetch_page(cursor):
+            rows = await self.bot.db.message_get_page(guild.id, cursor, TOPICS_PER_PAGE + 1)
+            if len(rows) > TOPICS_PER_PAGE:
+                last = rows[TOPICS_PER_PAGE - 1]
+                return rows[:TOPICS_PER_PAGE], (last['priority_level'], last['id'])
+            return rows, None
+
+        def build_embed(rows, page):
+            embed = discord.Embed(title=f"On going issues and suggestions for {guild.name}",
+                                  color=discord.Color.orange())
+            for todo in rows:
                 if len(todo['title']) > 20:
                     trucated_message = todo['title'][0:20] + "..."
                 else:
                     trucated_message = todo['title']
                 if todo['priority_level'] >= 10:
                     embed.add_field(name=f"**ID: {todo['id']} Priority Level: {todo['priority_level']}**",
-                                    value=f"**Title: {trucated_message}**\nLink to post: {self.construct_message_link(interaction.guild.id, guild_channel, todo['message_id'])}",
+                                    value=f"**Title: {trucated_message}**\nLink to post: {self.construct_message_link(guild.id, guild_channel, todo['message_id'])}",
                                     inline=False)
                 else:
                     embed.add_field(name=f"ID: {todo['id']} Priority Level: {todo['priority_level']}",
-                                    value=f"Title: {trucated_message}\nLink to post: {self.construct_message_link(interaction.guild.id, guild_channel, todo['message_id'])}", inline=False)
-        elif len(embed.fields) == 0:
-            embed.description = "No open topics!"
+                                    value=f"Title: {trucated_message}\nLink to post: {self.construct_message_link(guild.id, guild_channel, todo['message_id'])}", inline=False)
+            if len(embed.fields) == 0:
+                embed.description = "No open topics!"
+            embed.set_footer(text=f"Page {page}")
+            return embed
+
+        view = PageView(interaction, fetch_page, build_embed)
+        embed = await view.render()
+        if view.next_cursor is None:
+            # everything fits on one page, no need for buttons
+            view.stop()
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
+    @app_commands.guild_only()
+    @app_commands.command(name="search")
+    async def search(self, interaction: discord.Interaction, query: str):
+        """
+        Searches open and closed topics
+
+        Args:
+            query: Words to look for in topic titles and messages
+        """
+        guild = interaction.guild
+        guild_channel = await self.bot.db.guild_channel_get(guild.id)
+        outcomes = {None: "Open", "accept": "Accepted", "deny": "Denied"}
+
+        async def fetch_page(offset):
+            offset = offset or 0
+            rows = await self.bot.db.message_search(guild.id, query, TOPICS_PER_PAGE + 1, offset)
+            if len(rows) > TOPICS_PER_PAGE:
+                return rows[:TOPICS_PER_PAGE], offset + TOPICS_PER_PAGE
+            return rows, None
+
+        def build_embed(rows, page):
+            embed = discord.Embed(title=f"Topics matching \"{query[:200]}\"", color=discord.Color.blurple())
+            for todo in rows:
+                if len(todo['title']) > 60:
+                    trucated_message = todo['title'][0:60] + "..."
+                else:
+                    trucated_message = todo['title']
+                status = outcomes.get(todo['outcome'], todo['outcome'])
+                embed.add_field(name=f"ID: {todo['id']} {status} Priority Level: {todo['priority_level']}",
+                                value=f"Title: {trucated_message}\nLink to post: {self.construct_message_link(guild.id, guild_channel, todo['message_id'])}", inline=False)
+            if len(embed.fields) == 0:
+                embed.description = "No topics found!"
+            embed.set_footer(text=f"Page {page}")
+            return embed
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        view = PageView(interaction, fetch_page, build_embed)
+        embed = await view.render()
+        if view.next_cursor is None:
+            view.stop()
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
 
 async def setup(bot):
@@ -0,0 +1,56 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+
+class Stats(commands.Cog):
+    """Summarises the bot's latency and throughput metrics"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def format_histogram(self, name: str, label: str, limit: int = 8) -> str:
+        lines = []
+        for labels, count, p50, p95, p99 in self.bot.metrics.summary(name)[:limit]:
+            key = " ".join(str(v) for k, v in labels.items() if k != "status" or v != "ok") or name
+            lines.append(f"`{key}` n={count} p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms p99={p99 * 1000:.0f}ms")
+        # embed field values are limited to 1024 characters
+        return "\n".join(lines)[:1024] or f"No {label} recorded yet"
+
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.command(name="stats")
+    async def stats(self, interaction: discord.Interaction):
+        """Shows latency and throughput statistics, requires administrator perms"""
+        db = self.bot.db
+        embed = discord.Embed(title="Bot statistics", color=discord.Color.dark_blue())
+        embed.add_field(name="Commands", value=self.format_histogram("command_seconds", "commands"), inline=False)
+        embed.add_field(name="/send stages", value=self.format_histogram("send_stage_seconds", "topics sent"), inline=False)
+        embed.add_field(name="Database queries", value=self.format_histogram("db_query_seconds", "queries"), inline=False)
+        embed.add_field(name="Discord REST calls", value=self.format_histogram("discord_rest_seconds", "REST calls"), inline=False)
+        embed.add_field(name="Reaction events", value=self.format_histogram("reaction_seconds", "reactions"), inline=False)
+        embed.add_field(name="Outbound queue wait", value=self.format_histogram("outbound_wait_seconds", "queued calls"), inline=False)
+
+        cache = db.cache_info()
+        lookups = cache['hits'] + cache['misses']
+        hit_rate = f"{cache['hits'] / lookups:.1%}" if lookups else "n/a"
+        embed.add_field(name="Settings cache",
+                        value=f"{cache['size']} guilds, {cache['hits']} hits, {cache['misses']} misses ({hit_rate})")
+        pool = db.pool_info()
+        average_wait = pool['total_wait_ms'] / pool['acquires'] if pool['acquires'] else 0
+        embed.add_field(name="Connection pool",
+                        value=f"{pool['size']} open, {pool['idle']} idle\nacquire wait avg {average_wait:.1f}ms, max {pool['max_wait_ms']:.1f}ms")
+        flush = db.flush_stats
+        embed.add_field(name="Priority flushes",
+                        value=f"{flush['flushes']} flushes, {flush['rows']} rows, {len(db.pending_priorities)} pending\n"
+                              f"last {flush['last_size']} rows in {flush['last_latency_ms']:.1f}ms, max {flush['max_latency_ms']:.1f}ms")
+        outbound = self.bot.outbound
+        depth = outbound.depth()
+        embed.add_field(name="Outbound queue",
+                        value=f"{sum(depth.values())} waiting ({' / '.join(f'{n}' for n in depth.values())} interactive / background)\n"
+                              f"{outbound.busy_channels()} busy channels, {outbound.coalesced} edits coalesced")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
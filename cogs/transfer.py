@@ -0,0 +1,79 @@
+import io
+import tempfile
+import time
+
+import asyncpg
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils.transfer import read_records
+
+
+TABLE_CHOICES = [
+    app_commands.Choice(name="Open topics", value="topics"),
+    app_commands.Choice(name="Closed topics", value="archive"),
+    app_commands.Choice(name="Settings", value="settings"),
+]
+FORMAT_CHOICES = [
+    app_commands.Choice(name="CSV", value="csv"),
+    app_commands.Choice(name="JSON lines", value="jsonl"),
+]
+
+
+class Transfer(commands.Cog):
+    """Backs up and restores a guild's topics and settings"""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.choices(table=TABLE_CHOICES, format=FORMAT_CHOICES)
+    @app_commands.command(name="export")
+    async def export(self, interaction: discord.Interaction, table: str, format: str = "csv"):
+        """Exports this server's topics or settings as a file, requires administrator perms"""
+        await interaction.response.defer(ephemeral=True)
+        guild = interaction.guild
+        # rows are streamed to disk, never held in memory all at once
+        with tempfile.TemporaryFile() as fp:
+            start = time.perf_counter()
+            rows = await self.bot.db.guild_export(guild.id, table, format, fp)
+            elapsed = time.perf_counter() - start
+            size = fp.tell()
+            if size > guild.filesize_limit:
+                return await interaction.followup.send(
+                    f"The export is {size / 2**20:.1f} MiB, more than this server's upload limit. "
+                    f"Run `python transfer.py export --guild {guild.id} --table {table} --format {format}` instead.",
+                    ephemeral=True)
+            fp.seek(0)
+            await interaction.followup.send(f"Exported {rows} rows in {elapsed:.2f}s",
+                                            file=discord.File(fp, filename=f"{table}-{guild.id}.{format}"),
+                                            ephemeral=True)
+
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.choices(table=TABLE_CHOICES)
+    @app_commands.command(name="import")
+    async def import_(self, interaction: discord.Interaction, table: str, file: discord.Attachment):
+        """Imports topics or settings from a file made by /export, requires administrator perms"""
+        format = file.filename.rsplit(".", 1)[-1].lower()
+        if format not in ("csv", "jsonl"):
+            return await interaction.response.send_message("The file must be a .csv or .jsonl export", ephemeral=True)
+        await interaction.response.defer(ephemeral=True)
+        with tempfile.TemporaryFile() as fp:
+            await file.save(fp)
+            fp.seek(0)
+            text = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+            start = time.perf_counter()
+            try:
+                read, written = await self.bot.db.guild_import(interaction.guild.id, table, read_records(text, table, format))
+            except (ValueError, IndexError, TypeError, asyncpg.PostgresError) as e:
+                return await interaction.followup.send(f"Import failed, nothing was changed: {e}"[:2000], ephemeral=True)
+            elapsed = time.perf_counter() - start
+        skipped = f", {read - written} skipped as their IDs are already taken" if read != written else ""
+        await interaction.followup.send(f"Imported {written} of {read} rows in {elapsed:.2f}s{skipped}", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Transfer(bot))
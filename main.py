@@ -1,55 +1,149 @@
+import argparse
+import hashlib
+import json
 import os
 import sys
+import time
 from traceback import format_exception
 
 import asyncio
 import discord
 from discord.ext import commands
 import logging
-import yaml
+import signal
 
+from utils.config import Config, ConfigError, load_config
+from utils.metrics import InstrumentedTree, Metrics, http_trace, record_command
+from utils.outbound import Outbound
 from utils.sql import SQLDB
 
 
 console_logger = logging.getLogger("main")
 
 
-def read_config(config: str) -> str:
-    try:
-        with open("data/config.yml", "r") as f:
-            loadedYml = yaml.safe_load(f)
-            return loadedYml[config]
-    except FileNotFoundError:
-        print("Cannot find config.yml. Does it exist?")
-        sys.exit(1)
+def client_options(cache_profile: str) -> dict:
+    """Gateway intents and cache settings for a cache profile"""
+    if cache_profile == "full":
+        return {"intents": discord.Intents.all(), "member_cache_flags": discord.MemberCacheFlags.all()}
+    # Everything the bot does works from guild/channel/role data, raw reaction payloads and interactions
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_reactions = True
+    return {"intents": intents, "member_cache_flags": discord.MemberCacheFlags.none(),
+            "chunk_guilds_at_startup": False, "max_messages": None}
 
 
-class StaffToDoList(commands.Bot):
+class StaffToDoList(commands.AutoShardedBot):
     """A bot designed to handle incoming messages and anonymously output them to a channel. Then rate them by priority"""
 
-    def __init__(self):
-        super().__init__(command_prefix=read_config('prefix'),
+    def __init__(self, config: Config, force_sync: bool = False):
+        self.config = config
+        self.force_sync = force_sync
+        self.started_at = time.perf_counter()
+        # phase -> seconds, logged once the bot is first ready
+        self.startup_timings = {}
+        self.closing = None
+        self.metrics = Metrics()
+        self.outbound = Outbound(self.metrics, config.outbound_concurrency)
+        super().__init__(command_prefix=config.prefix,
                          description="The bot to handle suggestions from all members of a team!",
                          allow_mentions=discord.AllowedMentions(everyone=False, users=False, roles=False),
-                         intents=discord.Intents().all(), help_command=None)
+                         help_command=None, **client_options(config.cache_profile),
+                         shard_count=config.shard_count or None, shard_ids=config.shard_ids,
+                         tree_cls=InstrumentedTree, http_trace=http_trace(self.metrics))
         self.db = SQLDB(self)
 
+    async def timed(self, phase, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start
+
     async def setup_hook(self) -> None:
-        await self.db.startup()
-        await self.load_cogs()
+        self.startup_timings["login"] = time.perf_counter() - self.started_at
+        if self.config.metrics_port:
+            await self.metrics.start_server(self.config.metrics_host, self.config.metrics_port)
+        # Loading the cogs does no I/O, it runs while the database startup waits on its connections
+        await asyncio.gather(self.timed("database", self.db.startup()), self.timed("cogs", self.load_cogs()))
+        await self.timed("sync", self.sync_tree())
+        try:
+            self.loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.reload_config()))
+        except (NotImplementedError, AttributeError):
+            # no SIGHUP on Windows
+            pass
+
+    async def reload_config(self):
+        """Re-reads the reloadable keys of the config file, keeping everything else as it was at boot"""
+        try:
+            new_config = self.config.reloaded(load_config())
+        except ConfigError as e:
+            console_logger.error(f"Config reload failed, keeping the current config: {e}")
+            return
+        old_config, self.config = self.config, new_config
+        console_logger.info("Config reloaded")
+        self.db.start_flush_task()
+        if new_config.priority_flush_interval <= 0:
+            # priority writes go straight to the database from now on, so the buffered ones must land first
+            await self.db.priority_flush()
+        if self.is_ready():
+            await self.set_activity()
+        self.dispatch("config_reload", old_config, new_config)
+
+    async def set_activity(self):
+        await self.change_presence(
+            activity=discord.Activity(name=self.config.activity, type=discord.ActivityType.listening))
+
+    async def close(self):
+        """Disconnects, then flushes pending writes and closes the database, once however often it is called"""
+        # a signal handler and leaving `async with` can both close the bot, the first one does the work
+        if self.closing is None:
+            self.closing = asyncio.create_task(self._close())
+        await asyncio.shield(self.closing)
+
+    async def _close(self):
+        await super().close()
+        await self.db.close()
+        await self.metrics.close()
+
+    async def __aexit__(self, *exc_info):
+        # discord.py skips close() here if the connection was already closed, which would skip our own cleanup
+        await self.close()
+
+    async def on_app_command_completion(self, interaction, command):
+        record_command(self.metrics, interaction, "ok")
+
+    def tree_hash(self) -> str:
+        """Hashes the global app command tree as it would be sent to Discord"""
+        # commands are listed in cog load order, which must not change the hash
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands()), key=lambda c: c["name"])
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_tree(self):
+        """Syncs the command tree only if it changed since the last sync, unless forced"""
+        tree_hash = self.tree_hash()
+        key = f"command_tree_hash:{self.application_id}"
+        if not self.force_sync and await self.db.state_get(key) == tree_hash:
+            console_logger.info("Command tree unchanged, skipping sync")
+            return
         await self.tree.sync()
+        await self.db.state_set(key, tree_hash)
+        console_logger.info("Command tree synced")
+
+    async def load_cog(self, cog):
+        try:
+            await self.load_extension("cogs." + cog)
+            console_logger.info(f"{cog} loaded")
+
+        except Exception as e:
+            console_logger.exception(
+                f"Failed to load {cog}:\n{''.join(format_exception(type(e), e, e.__traceback__))}")
 
     async def load_cogs(self):
-        cog_files = [file[:-3] for file in os.listdir("cogs") if file.endswith(".py")]
+        cog_files = sorted(file[:-3] for file in os.listdir("cogs") if file.endswith(".py"))
         if cog_files:
             for cog in cog_files:
-                try:
-                    await self.load_extension("cogs." + cog)
-                    console_logger.info(f"{cog} loaded")
-
-                except Exception as e:
-                    console_logger.exception(
-                        f"Failed to load {cog}:\n{''.join(format_exception(type(e), e, e.__traceback__))}")
+                await self.load_cog(cog)
 
     async def on_command_error(self, ctx, error):
         """Handles errors"""
@@ -93,18 +187,39 @@ class StaffToDoList(commands.Bot):
     async def on_ready(self):
         """Loads code on boot"""
         console_logger.info(f"We are logged in as {self.user.name}!")
-        await self.change_presence(
-            activity=discord.Activity(name=read_config("activity"), type=discord.ActivityType.listening))
+        if "ready" not in self.startup_timings:
+            self.startup_timings["ready"] = time.perf_counter() - self.started_at
+            console_logger.info("Startup timings: " + ", ".join(
+                f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.startup_timings.items()))
+        await self.set_activity()
 
 
-async def startup():
+async def startup(force_sync: bool = False):
     discord.utils.setup_logging(handler=logging.FileHandler('/data/main.log', encoding='utf-8', mode='w'))
     # stream handler
     discord.utils.setup_logging()
 
-    bot = StaffToDoList()
-    await bot.start(read_config("token"))
+    try:
+        config = load_config()
+    except ConfigError as e:
+        print(e)
+        sys.exit(1)
+
+    bot = StaffToDoList(config, force_sync=force_sync)
+    async with bot:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                # close cleanly on docker stop and Ctrl+C, so buffered priority writes are flushed
+                loop.add_signal_handler(sig, lambda: asyncio.create_task(bot.close()))
+            except NotImplementedError:
+                # no signal handlers on Windows, Ctrl+C still leaves `async with` through KeyboardInterrupt
+                pass
+        await bot.start(config.token)
 
 
 if __name__ == "__main__":
-    asyncio.run(startup())
+    parser = argparse.ArgumentParser(description="Runs the topic bot")
+    parser.add_argument("--sync", action="store_true", help="sync the command tree even if it has not changed")
+    args = parser.parse_args()
+    asyncio.run(startup(force_sync=args.sync))
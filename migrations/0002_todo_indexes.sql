@@ -0,0 +1,3 @@
+CREATE UNIQUE INDEX IF NOT EXISTS todo_message_id_idx ON todo (message_id);
+
+CREATE INDEX IF NOT EXISTS todo_guild_priority_idx ON todo (guild_id, priority_level DESC);
@@ -0,0 +1 @@
+ALTER TABLE todo DROP COLUMN IF EXISTS message_link;
@@ -0,0 +1,4 @@
+-- (priority_level, id) is the keyset used to page through open topics
+CREATE INDEX IF NOT EXISTS todo_guild_priority_id_idx ON todo (guild_id, priority_level DESC, id DESC);
+
+DROP INDEX IF EXISTS todo_guild_priority_idx;
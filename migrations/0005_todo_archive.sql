@@ -0,0 +1,27 @@
+-- Closed topics are moved here so the live todo table only holds open ones
+CREATE TABLE IF NOT EXISTS todo_archive
+(
+    id INT PRIMARY KEY,
+    guild_id BIGINT NOT NULL,
+    title TEXT,
+    message TEXT,
+    priority_level INT,
+    message_id BIGINT,
+    outcome TEXT NOT NULL,
+    reason TEXT,
+    closed_by BIGINT,
+    closed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    search TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(message, '')), 'B')) STORED
+);
+
+CREATE INDEX IF NOT EXISTS todo_archive_guild_closed_idx ON todo_archive (guild_id, closed_at DESC);
+
+CREATE INDEX IF NOT EXISTS todo_archive_search_idx ON todo_archive USING GIN (search);
+
+ALTER TABLE todo ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(message, '')), 'B')) STORED;
+
+CREATE INDEX IF NOT EXISTS todo_search_idx ON todo USING GIN (search);
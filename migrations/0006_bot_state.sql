@@ -0,0 +1,6 @@
+-- Small key/value store for state the bot keeps across restarts
+CREATE TABLE IF NOT EXISTS bot_state
+(
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
@@ -0,0 +1,2 @@
+-- The pinned priority board message in the output channel, NULL when the board is disabled
+ALTER TABLE settings ADD COLUMN IF NOT EXISTS board_message_id BIGINT;
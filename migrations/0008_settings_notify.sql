@@ -0,0 +1,15 @@
+-- Tells every bot process when a guild's settings change, so they can drop their cached copy.
+-- origin is the application_name of the connection that made the change, so a process can ignore its own writes.
+CREATE OR REPLACE FUNCTION settings_notify() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('settings_changed', json_build_object(
+        'guild_id', COALESCE(NEW.guild_id, OLD.guild_id)::TEXT,
+        'origin', current_setting('application_name'))::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS settings_notify ON settings;
+
+CREATE TRIGGER settings_notify AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH ROW EXECUTE FUNCTION settings_notify();
@@ -0,0 +1,60 @@
+"""
+Exports and imports a guild's topics and settings without the bot running, using the database from data/config.yml.
+
+Usage:
+    python transfer.py export --guild ID --table topics [--format csv] [--file topics.csv]
+    python transfer.py import --guild ID --table topics --file topics.csv
+
+Files are the same as the ones /export and /import use. Topics whose ID is already taken are skipped on import.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+
+from utils.config import ConfigError, load_config
+from utils.transfer import FORMATS, TABLES, export_table, import_table, read_records
+
+
+async def main(args):
+    conn = await asyncpg.connect(load_config().db)
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            rows = await export_table(conn, args.guild, args.table, args.format, args.file)
+        else:
+            with open(args.file, encoding="utf-8", newline="") as fp:
+                read, rows = await import_table(conn, args.guild, args.table, read_records(fp, args.table, args.format))
+            if read != rows:
+                print(f"{read - rows} of {read} rows skipped as their IDs are already taken")
+    finally:
+        await conn.close()
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(args.file)
+    print(f"{args.command.capitalize()}ed {rows} rows ({size / 2**20:.1f} MiB) in {elapsed:.2f}s, "
+          f"{rows / elapsed:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("--guild", type=int, required=True)
+    parser.add_argument("--table", choices=TABLES, required=True)
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension, or csv")
+    parser.add_argument("--file", help="defaults to <table>-<guild>.<format> for exports")
+    args = parser.parse_args()
+    if args.format is None:
+        extension = args.file.rsplit(".", 1)[-1] if args.file else None
+        args.format = extension if extension in FORMATS else "csv"
+    if args.file is None:
+        if args.command == "import":
+            parser.error("--file is required for imports")
+        args.file = f"{args.table}-{args.guild}.{args.format}"
+    try:
+        asyncio.run(main(args))
+    except ConfigError as e:
+        print(e)
+        sys.exit(1)
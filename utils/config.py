@@ -0,0 +1,111 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import dataclasses
+from dataclasses import dataclass, fields
+
+import yaml
+
+
+CONFIG_PATH = "data/config.yml"
+CACHE_PROFILES = ("minimal", "full")
+
+
+class ConfigError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Config:
+    token: str
+    db: str
+    activity: str
+    prefix: str
+    # Apply reaction adds/removes as +1/-1 instead of re-fetching the message
+    incremental_reactions: bool = False
+    # Seconds between recounting the messages touched by incremental updates
+    reaction_reconcile_interval: float = 300
+    # Seconds to buffer priority updates before writing them, 0 writes immediately
+    priority_flush_interval: float = 1.0
+    # Recount open topics from the output channel history after connecting, to catch reactions missed while offline
+    startup_reconcile: bool = True
+    # Guilds whose history is walked at the same time
+    startup_reconcile_concurrency: int = 2
+    # Seconds to pause after every 100 messages of history, to leave rate limit room for commands
+    startup_reconcile_page_delay: float = 1.0
+    db_pool_min_size: int = 2
+    db_pool_max_size: int = 10
+    # Seconds before a query is cancelled
+    db_command_timeout: float = 10
+    # Seconds before an idle pooled connection is closed
+    db_max_inactive_connection_lifetime: float = 300
+    db_statement_cache_size: int = 100
+    # Set when connecting through PgBouncer in transaction mode, disables prepared statements
+    db_pgbouncer: bool = False
+    # Minimum seconds between edits of a guild's pinned priority board
+    board_interval: float = 5
+    # Topics shown on the priority board
+    board_size: int = 20
+    # Discord REST calls per channel in flight at once, separately for fetches and for sends/edits/reactions
+    outbound_concurrency: int = 4
+    # "minimal" only asks Discord for guilds and reactions and caches no members, "full" requests every intent
+    cache_profile: str = "minimal"
+    # Total number of shards across every process, 0 lets Discord pick and runs all of them in this process
+    shard_count: int = 0
+    # Shards this process runs, for splitting shard_count across processes. Unset runs all of them
+    shard_ids: list = None
+    # Direct DSN for migrations and the settings change listener, when db points at PgBouncer in transaction mode
+    db_listen_dsn: str = None
+    # Local port to serve Prometheus metrics on, 0 disables the endpoint
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
+
+    # keys that can be changed on SIGHUP without restarting
+    RELOADABLE = ("activity", "incremental_reactions", "reaction_reconcile_interval", "priority_flush_interval",
+                  "startup_reconcile", "startup_reconcile_concurrency", "startup_reconcile_page_delay",
+                  "board_interval", "board_size")
+
+    def reloaded(self, new: "Config") -> "Config":
+        """Returns a copy of this config with only the reloadable keys taken from new"""
+        return dataclasses.replace(self, **{key: getattr(new, key) for key in self.RELOADABLE})
+
+
+def load_config(path: str = CONFIG_PATH) -> Config:
+    """Parses the config file into a Config, raising ConfigError on missing or mistyped keys"""
+    try:
+        with open(path, "r") as f:
+            loaded = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        raise ConfigError(f"Cannot find {path}. Does it exist?")
+    except yaml.YAMLError as e:
+        raise ConfigError(f"{path} is not valid YAML: {e}")
+
+    values = {}
+    missing = []
+    for field in fields(Config):
+        value = loaded.get(field.name)
+        if value is None:
+            if field.default is dataclasses.MISSING:
+                missing.append(field.name)
+            continue
+        if field.type is bool and not isinstance(value, bool):
+            raise ConfigError(f"{field.name} in {path} must be true or false, got {value!r}")
+        if field.type is list and not isinstance(value, list):
+            raise ConfigError(f"{field.name} in {path} must be a list, got {value!r}")
+        try:
+            values[field.name] = field.type(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"{field.name} in {path} must be a {field.type.__name__}, got {value!r}")
+
+    if missing:
+        raise ConfigError(f"{path} is missing required keys: {', '.join(missing)}")
+    shard_ids = values.get("shard_ids")
+    if shard_ids is not None:
+        shard_count = values.get("shard_count", 0)
+        if not shard_count or not all(isinstance(i, int) and 0 <= i < shard_count for i in shard_ids):
+            raise ConfigError(f"shard_ids in {path} must be shard numbers below shard_count, which must be set")
+    if values.get("cache_profile", Config.cache_profile) not in CACHE_PROFILES:
+        raise ConfigError(f"cache_profile in {path} must be one of {', '.join(CACHE_PROFILES)}, got {values['cache_profile']!r}")
+    return Config(**values)
@@ -1,3 +1,5 @@
+import time
+
 import discord
 
 
@@ -8,6 +10,15 @@ class YesNoView(discord.ui.View):
         self.result = None
         super().__init__(timeout=60)
 
+    async def wait(self) -> bool:
+        # the time the user takes to answer is not part of the command's latency, see record_command
+        start = time.perf_counter()
+        try:
+            return await super().wait()
+        finally:
+            extras = self.interaction.extras
+            extras["waited"] = extras.get("waited", 0) + time.perf_counter() - start
+
     async def on_error(self, interaction, exc, item):
         self.stop()
 
@@ -23,3 +34,46 @@ class YesNoView(discord.ui.View):
     async def no_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         self.result = False
         self.stop()
+
+
+class PageView(discord.ui.View):
+    """Pages through results that are fetched on demand.
+
+    fetch_page(cursor) returns (rows, next_cursor), next_cursor is None on the last page.
+    build_embed(rows, page_number) returns the embed to show.
+    """
+    def __init__(self, interaction, fetch_page, build_embed):
+        self.interaction = interaction
+        self.bot = interaction.client
+        self.fetch_page = fetch_page
+        self.build_embed = build_embed
+        # the cursor each visited page was fetched with, the last one is the current page
+        self.cursors = [None]
+        self.next_cursor = None
+        super().__init__(timeout=180)
+
+    async def render(self):
+        rows, self.next_cursor = await self.fetch_page(self.cursors[-1])
+        self.prev_button.disabled = len(self.cursors) == 1
+        self.next_button.disabled = self.next_cursor is None
+        return self.build_embed(rows, len(self.cursors))
+
+    async def on_error(self, interaction, exc, item):
+        self.stop()
+
+    async def on_timeout(self):
+        try:
+            await self.interaction.edit_original_response(view=None)
+        except discord.HTTPException:
+            pass
+        self.stop()
+
+    @discord.ui.button(label='Prev', style=discord.ButtonStyle.grey)
+    async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.grey)
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
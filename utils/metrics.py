@@ -0,0 +1,197 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import aiohttp
+import discord
+from discord import app_commands
+
+
+console_logger = logging.getLogger("main")
+
+# upper bounds in seconds, shared by every histogram
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=()) -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in (*labels, *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metrics:
+    """Latency histograms and gauges, rendered in the Prometheus text format"""
+
+    def __init__(self, prefix: str = "topicbot"):
+        self.prefix = prefix
+        # name -> {sorted label tuple -> Histogram}
+        self.histograms = {}
+        # name -> (help, callable returning a number or a {label tuple: number} dict)
+        self.gauges = {}
+        self.server = None
+
+    def observe(self, name: str, seconds: float, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name: str, help: str, getter):
+        self.gauges[name] = (help, getter)
+
+    def summary(self, name: str):
+        """Returns (labels, count, p50, p95, p99) for every series of a histogram, busiest first"""
+        rows = [(dict(key), h.count, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                for key, h in self.histograms.get(name, {}).items()]
+        return sorted(rows, key=lambda r: r[1], reverse=True)
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self.histograms.items():
+            full = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {full} histogram")
+            for key, h in series.items():
+                cumulative = 0
+                for bound, n in zip((*BUCKETS, "+Inf"), h.counts):
+                    cumulative += n
+                    lines.append(f"{full}_bucket{_labels(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{full}_sum{_labels(key)} {h.sum}")
+                lines.append(f"{full}_count{_labels(key)} {h.count}")
+        for name, (help, getter) in self.gauges.items():
+            full = f"{self.prefix}_{name}"
+            try:
+                value = getter()
+            except Exception:
+                continue
+            lines.append(f"# HELP {full} {help}")
+            lines.append(f"# TYPE {full} gauge")
+            if isinstance(value, dict):
+                for key, v in value.items():
+                    lines.append(f"{full}{_labels(key)} {v}")
+            else:
+                lines.append(f"{full} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if len(request) >= 2 and request[0] == "GET" and request[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        console_logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+class InstrumentedTree(app_commands.CommandTree):
+    """Command tree that stamps interactions so command latency can be recorded on completion"""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        record_command(self.client.metrics, interaction, "error")
+        await super().on_error(interaction, error)
+
+
+def record_command(metrics: Metrics, interaction: discord.Interaction, status: str):
+    started = interaction.extras.get("started")
+    if started is not None and interaction.command:
+        # minus the time spent waiting for the user to answer a confirmation prompt
+        metrics.observe("command_seconds", time.perf_counter() - started - interaction.extras.get("waited", 0),
+                        command=interaction.command.qualified_name, status=status)
+
+
+_SNOWFLAKE = re.compile(r"/\d{15,}")
+# Interaction and webhook tokens, and reaction emoji, would each become a series of their own, and tokens must not
+# be published on the metrics endpoint
+_TOKEN = re.compile(r"/(interactions|webhooks)/(?:\{id\}|\d+)/[^/]+")
+_EMOJI = re.compile(r"/reactions/[^/]+")
+
+
+def route_template(path: str) -> str:
+    """Reduces a Discord API path to its route, e.g. /webhooks/{id}/{token}/messages/@original"""
+    route = _SNOWFLAKE.sub("/{id}", path)
+    route = _TOKEN.sub(r"/\1/{id}/{token}", route)
+    return _EMOJI.sub("/reactions/{emoji}", route)
+
+
+def http_trace(metrics: Metrics) -> aiohttp.TraceConfig:
+    """aiohttp trace that records the duration of every Discord REST call by route"""
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        metrics.observe("discord_rest_seconds", time.perf_counter() - ctx.started,
+                        method=params.method, route=route_template(params.url.path), status=params.response.status)
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
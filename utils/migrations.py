@@ -0,0 +1,53 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import logging
+import os
+import re
+
+import asyncpg
+
+
+console_logger = logging.getLogger("main")
+
+MIGRATIONS_DIR = "migrations"
+# arbitrary key so that several processes booting at once do not migrate concurrently
+MIGRATION_LOCK = 0x70D0
+
+
+def load_migrations(path: str = MIGRATIONS_DIR):
+    """Returns (version, name, sql) for every migration file, in order"""
+    migrations = []
+    for file in sorted(os.listdir(path)):
+        match = re.match(r"^(\d+)_(.+)\.sql$", file)
+        if not match:
+            continue
+        with open(os.path.join(path, file), "r") as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    return migrations
+
+
+async def migrate(conn: asyncpg.Connection, target: int = None, path: str = MIGRATIONS_DIR):
+    """Applies every migration newer than the recorded version, up to target if given, in one transaction.
+
+    conn must be a direct connection rather than one through PgBouncer, the lock is held by the transaction.
+    """
+    async with conn.transaction():
+        # taken before anything else, so processes booting together on an empty database do not race the CREATE TABLE
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations
+            (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )""")
+        applied = {r['version'] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, name, sql in load_migrations(path):
+            if version in applied or (target is not None and version > target):
+                continue
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+            console_logger.info(f"Applied migration {version:04d}_{name}")
@@ -0,0 +1,158 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import asyncio
+import heapq
+import itertools
+import time
+
+
+# Work someone is waiting on through an interaction runs before background work in the same channel
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+class _Job:
+    def __init__(self, kind, priority, call):
+        self.kind = kind
+        self.priority = priority
+        self.call = call
+        self.started = False
+        self.queued_at = time.perf_counter()
+        self.futures = []
+
+    def waiter(self):
+        future = asyncio.get_running_loop().create_future()
+        self.futures.append(future)
+        return future
+
+    async def run(self, metrics):
+        self.started = True
+        metrics.observe("outbound_wait_seconds", time.perf_counter() - self.queued_at,
+                        kind=self.kind, priority=PRIORITY_NAMES[self.priority])
+        try:
+            result = await self.call()
+        except Exception as e:
+            for future in self.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in self.futures:
+                if not future.done():
+                    future.set_result(result)
+
+
+class Outbound:
+    """Queues Discord REST calls per channel, so a burst against one channel does not stall everything else.
+
+    discord.py still does the actual rate limiting, this only decides the order calls are handed to it in. Each
+    channel has a read lane for fetches and a write lane for everything else, so fetches never wait behind sends
+    and edits. Each lane runs up to concurrency calls at once, interactive ones first. An edit that is still
+    waiting in the queue is replaced by a newer edit of the same message, and everyone waiting on either gets the
+    result of the newest.
+    """
+
+    def __init__(self, metrics, concurrency: int = 4):
+        self.metrics = metrics
+        self.concurrency = concurrency
+        # (channel_id, lane) -> heap of (priority, sequence, job)
+        self.queues = {}
+        # (channel_id, lane) -> worker tasks draining that queue
+        self.workers = {}
+        # message_id -> (job, [message, kwargs]) for edits that have not started yet
+        self.pending_edits = {}
+        # message_id -> [lock, edits using it], held while an edit is in flight so edits land in the order they were queued
+        self.edit_locks = {}
+        self.coalesced = 0
+        self._sequence = itertools.count()
+        metrics.gauge("outbound_queue_depth", "Discord REST calls waiting in the outbound queue",
+                      lambda: {(("priority", PRIORITY_NAMES[p]),): n for p, n in self.depth().items()})
+        metrics.gauge("outbound_edits_coalesced", "Edits replaced by a newer edit before being sent", lambda: self.coalesced)
+
+    def depth(self):
+        depth = {INTERACTIVE: 0, BACKGROUND: 0}
+        for queue in self.queues.values():
+            # jobs bumped to a higher priority are in the heap twice
+            for job in {job for _, _, job in queue if not job.started}:
+                depth[job.priority] += 1
+        return depth
+
+    def busy_channels(self):
+        return len({channel_id for channel_id, _ in self.workers})
+
+    def _enqueue(self, key, job):
+        queue = self.queues.setdefault(key, [])
+        heapq.heappush(queue, (job.priority, next(self._sequence), job))
+        workers = self.workers.setdefault(key, set())
+        if len(workers) < self.concurrency:
+            workers.add(asyncio.create_task(self._drain(key)))
+
+    async def _drain(self, key):
+        queue = self.queues[key]
+        try:
+            while queue:
+                _, _, job = heapq.heappop(queue)
+                # a job that was bumped to a higher priority is in the heap twice
+                if not job.started:
+                    await job.run(self.metrics)
+        finally:
+            workers = self.workers[key]
+            workers.discard(asyncio.current_task())
+            if not workers:
+                del self.workers[key]
+                if not queue:
+                    del self.queues[key]
+
+    async def submit(self, channel_id, kind, call, priority=BACKGROUND, lane="write"):
+        """Queues call, a coroutine function making one REST call, and returns its result once it has run"""
+        job = _Job(kind, priority, call)
+        waiter = job.waiter()
+        self._enqueue((channel_id, lane), job)
+        return await waiter
+
+    async def send(self, channel, priority=INTERACTIVE, **kwargs):
+        return await self.submit(channel.id, "send", lambda: channel.send(**kwargs), priority)
+
+    async def add_reaction(self, message, emoji, priority=INTERACTIVE):
+        return await self.submit(message.channel.id, "add_reaction", lambda: message.add_reaction(emoji), priority)
+
+    async def fetch_message(self, channel, message_id, priority=BACKGROUND):
+        return await self.submit(channel.id, "fetch_message", lambda: channel.fetch_message(message_id), priority, "read")
+
+    async def edit(self, message, priority=INTERACTIVE, **kwargs):
+        """Edits a message, merging with an edit of the same message that has not been sent yet"""
+        pending = self.pending_edits.get(message.id)
+        if pending and not pending[0].started:
+            job, latest = pending
+            latest[0] = message
+            latest[1] = {**latest[1], **kwargs}
+            self.coalesced += 1
+            waiter = job.waiter()
+            if priority < job.priority:
+                job.priority = priority
+                self._enqueue((message.channel.id, "write"), job)
+            return await waiter
+
+        latest = [message, kwargs]
+
+        async def call():
+            self.pending_edits.pop(message.id, None)
+            entry = self.edit_locks.setdefault(message.id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    return await latest[0].edit(**latest[1])
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.edit_locks[message.id]
+
+        job = _Job("edit", priority, call)
+        self.pending_edits[message.id] = (job, latest)
+        waiter = job.waiter()
+        self._enqueue((message.channel.id, "write"), job)
+        return await waiter
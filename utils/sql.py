@@ -5,97 +5,452 @@
 #
 
 
+import asyncio
+import json
 import logging
+import os
+import socket
 import sys
+import time
 from traceback import format_exception
 
 import asyncpg
-import yaml
+
+from utils.migrations import migrate
+from utils.transfer import export_table, import_table
 
 
 console_logger = logging.getLogger("main")
 
 
+# Channel the settings table trigger notifies on, see migrations/0008_settings_notify.sql
+SETTINGS_CHANNEL = "settings_changed"
+
+# Every statement SQLDB runs, by name. asyncpg prepares each one per connection and keeps it in its statement cache.
+QUERIES = {
+    "priority_flush":
+        "UPDATE todo SET priority_level = CASE WHEN v.absolute THEN v.value ELSE todo.priority_level + v.value END "
+        "FROM unnest($1::BIGINT[], $2::BOOLEAN[], $3::INT[]) AS v(message_id, absolute, value) "
+        "WHERE todo.message_id = v.message_id",
+    "message_update": "UPDATE todo SET priority_level = $1 WHERE message_id = $2",
+    "message_increment": "UPDATE todo SET priority_level = priority_level + $1 WHERE message_id = $2",
+    "message_update_many":
+        "UPDATE todo SET priority_level = v.count FROM unnest($1::BIGINT[], $2::INT[]) AS v(message_id, count) "
+        "WHERE todo.message_id = v.message_id",
+    "message_get_ranking":
+        "SELECT id, left(title, 21) AS title, priority_level, message_id FROM todo WHERE guild_id = $1",
+    "message_get_priorities":
+        "SELECT message_id, priority_level FROM todo WHERE guild_id = $1 AND message_id IS NOT NULL",
+    "message_reserve_id": "SELECT nextval(pg_get_serial_sequence('todo', 'id'))",
+    "message_add":
+        "INSERT INTO todo (id, guild_id, title, message, priority_level, message_id) VALUES ($1, $2, $3, $4, $5, $6)",
+    # Only the start of the title is shown in listings, so the message body and the rest of the title are not fetched
+    "message_get_first_page":
+        "SELECT id, left(title, 21) AS title, priority_level, message_id FROM todo WHERE guild_id = $1 "
+        "ORDER BY priority_level DESC, id DESC LIMIT $2",
+    "message_get_page":
+        "SELECT id, left(title, 21) AS title, priority_level, message_id FROM todo WHERE guild_id = $1 "
+        "AND (priority_level, id) < ($2, $3) ORDER BY priority_level DESC, id DESC LIMIT $4",
+    "message_get_by_id": "SELECT id, title, message, priority_level, message_id FROM todo WHERE id = $1",
+    # a single statement, so the delete and the insert commit or fail together
+    "message_archive":
+        "WITH closed AS (DELETE FROM todo WHERE id = $1 "
+        "RETURNING id, guild_id, title, message, priority_level, message_id) "
+        "INSERT INTO todo_archive (id, guild_id, title, message, priority_level, message_id, outcome, reason, closed_by) "
+        "SELECT id, guild_id, title, message, priority_level, message_id, $2, $3, $4 FROM closed",
+    "message_get_by_ids":
+        "SELECT id, title, message, priority_level, message_id FROM todo WHERE guild_id = $1 AND id = ANY($2::INT[])",
+    "message_archive_many":
+        "WITH closed AS (DELETE FROM todo WHERE guild_id = $1 AND id = ANY($2::INT[]) "
+        "RETURNING id, guild_id, title, message, priority_level, message_id) "
+        "INSERT INTO todo_archive (id, guild_id, title, message, priority_level, message_id, outcome, reason, closed_by) "
+        "SELECT id, guild_id, title, message, priority_level, message_id, $3, $4, $5 FROM closed RETURNING id",
+    # open topics have a NULL outcome
+    "message_search":
+        "SELECT id, left(title, 61) AS title, priority_level, message_id, outcome FROM ("
+        "SELECT id, title, priority_level, message_id, NULL AS outcome, ts_rank(search, query) AS rank "
+        "FROM todo, websearch_to_tsquery('english', $2) AS query WHERE guild_id = $1 AND search @@ query "
+        "UNION ALL "
+        "SELECT id, title, priority_level, message_id, outcome, ts_rank(search, query) AS rank "
+        "FROM todo_archive, websearch_to_tsquery('english', $2) AS query WHERE guild_id = $1 AND search @@ query"
+        ") AS results ORDER BY rank DESC, id DESC LIMIT $3 OFFSET $4",
+    "state_get": "SELECT value FROM bot_state WHERE key = $1",
+    "state_set":
+        "INSERT INTO bot_state (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value",
+    "guild_get_every": "SELECT guild_id, output_channel_id, allowed_role_ids, board_message_id FROM settings",
+    "guild_get_all": "SELECT output_channel_id, allowed_role_ids, board_message_id FROM settings WHERE guild_id = $1",
+    "guild_board_set":
+        "UPDATE settings SET board_message_id = $1 WHERE guild_id = $2 "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+    "guild_add":
+        "INSERT INTO settings (guild_id) VALUES ($1) ON CONFLICT (guild_id) DO UPDATE SET guild_id = EXCLUDED.guild_id "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+    "guild_channel_add":
+        "UPDATE settings SET output_channel_id = $1 WHERE guild_id = $2 "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+    "guild_channel_remove":
+        "UPDATE settings SET output_channel_id = NULL WHERE guild_id = $1 "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+    "guild_role_add":
+        "UPDATE settings SET allowed_role_ids = array_append(allowed_role_ids, $1::BIGINT) WHERE guild_id = $2 "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+    "guild_role_remove":
+        "UPDATE settings SET allowed_role_ids = array_remove(allowed_role_ids, $1) WHERE guild_id = $2 "
+        "RETURNING output_channel_id, allowed_role_ids, board_message_id",
+}
+
+
 class SQLDB():
     def __init__(self, bot):
         self.bot = bot
+        self.db = None
+        # identifies this process' connections, so it can ignore notifications about its own writes
+        self.origin = f"topicbot-{socket.gethostname()}-{os.getpid()}"[:63]
+        self.listener = None
+        self.listen_task = None
+        # set while LISTEN is active and the settings cache was loaded after it started
+        self.listening = asyncio.Event()
+        # guild_id -> {"output_channel_id": ..., "allowed_role_ids": ..., "board_message_id": ...}, or None for guilds without a settings row
+        self.guild_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # message_id -> (absolute, value): pending priority writes, flushed together by the write-behind task
+        self.pending_priorities = {}
+        self.flush_task = None
+        # one flush at a time, so a caller that flushes knows every earlier write has landed when it returns
+        self.flush_lock = asyncio.Lock()
+        self.flush_stats = {"flushes": 0, "rows": 0, "last_size": 0, "last_latency_ms": 0.0, "max_latency_ms": 0.0}
+        self.acquire_stats = {"acquires": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
 
-    def read_config(self, config: str) -> str:
-        try:
-            with open("data/config.yml", "r") as f:
-                loadedYml = yaml.safe_load(f)
-                return loadedYml[config]
-        except FileNotFoundError:
-            print("Cannot find config.yml. Does it exist?")
-            sys.exit(1)
+        metrics = bot.metrics
+        metrics.gauge("guild_cache", "Guild settings cache size and hit/miss counters",
+                      lambda: {(("kind", k),): v for k, v in self.cache_info().items()})
+        metrics.gauge("db_pool", "asyncpg pool size and acquire counters",
+                      lambda: {(("kind", k),): v for k, v in self.pool_info().items()})
+        metrics.gauge("priority_flush", "Write-behind priority flush counters",
+                      lambda: {(("kind", k),): v for k, v in self.flush_stats.items()})
+        metrics.gauge("priority_pending", "Priority updates waiting to be flushed", lambda: len(self.pending_priorities))
+
+    @property
+    def flush_interval(self):
+        return self.bot.config.priority_flush_interval
 
     async def startup(self):
         """Sets up database pool for usage"""
-        self.db = await asyncpg.create_pool(self.read_config("db"))
+        config = self.bot.config
+        self.db = await asyncpg.create_pool(
+            config.db,
+            min_size=config.db_pool_min_size,
+            max_size=config.db_pool_max_size,
+            command_timeout=config.db_command_timeout,
+            max_inactive_connection_lifetime=config.db_max_inactive_connection_lifetime,
+            # PgBouncer in transaction mode cannot keep named prepared statements across transactions
+            statement_cache_size=0 if config.db_pgbouncer else config.db_statement_cache_size,
+            server_settings={"application_name": self.origin})
+
+        # migrations hold a lock for their whole transaction, which needs a real session rather than PgBouncer
+        conn = await asyncpg.connect(config.db_listen_dsn or config.db, server_settings={"application_name": self.origin})
+        try:
+            await migrate(conn)
+        except asyncpg.PostgresError as e:
+            console_logger.exception(
+                "A SQL error has occurred while running migrations, traceback is:\n{}".format("".join(
+                    format_exception(type(e), e, e.__traceback__))))
+            print(format_exception(type(e), e, e.__traceback__))
+            sys.exit(-1)
+        except FileNotFoundError:
+            print("migrations directory not found, please check your files")
+            sys.exit(-1)
+        finally:
+            await conn.close()
+
+        self.start_flush_task()
+        self.listen_task = asyncio.create_task(self.listen_settings())
+        try:
+            await asyncio.wait_for(self.listening.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            console_logger.warning("Not listening for settings changes yet, other processes' changes may be missed until then")
+            await self.guild_cache_load()
+
+    async def listen_settings(self):
+        """Keeps a connection listening for settings changes made by other processes, reconnecting when it drops"""
+        connected_before = False
+        while True:
+            try:
+                # LISTEN needs a session of its own, which PgBouncer in transaction mode cannot give
+                self.listener = await asyncpg.connect(self.bot.config.db_listen_dsn or self.bot.config.db,
+                                                      server_settings={"application_name": self.origin})
+                closed = asyncio.Event()
+                self.listener.add_termination_listener(lambda conn: closed.set())
+                await self.listener.add_listener(SETTINGS_CHANNEL, self._settings_notified)
+                # loaded only now, so a change made before LISTEN took effect cannot be missed
+                await self.guild_cache_load()
+                if connected_before:
+                    self.bot.dispatch("settings_invalidated", None)
+                connected_before = True
+                self.listening.set()
+                await closed.wait()
+                self.listening.clear()
+                console_logger.warning("Lost the settings notification connection, reconnecting")
+            except (OSError, asyncpg.PostgresError) as e:
+                console_logger.warning(f"Could not listen for settings changes, retrying: {e}")
+            await asyncio.sleep(5)
 
+    def _settings_notified(self, conn, pid, channel, payload):
+        data = json.loads(payload)
+        if data['origin'] == self.origin:
+            return
+        guild_id = int(data['guild_id'])
+        self.guild_cache.pop(guild_id, None)
+        self.bot.dispatch("settings_invalidated", guild_id)
+
+    def start_flush_task(self):
+        """Starts the write-behind task if batching is enabled and it is not already running"""
+        if self.flush_interval > 0 and (not self.flush_task or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.priority_flush_loop())
+
+    async def close(self):
+        """Flushes pending writes and closes the pool"""
+        if self.listen_task:
+            self.listen_task.cancel()
+            self.listen_task = None
+        if self.listener:
+            await self.listener.close()
+            self.listener = None
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        if self.db:
+            try:
+                await self.priority_flush()
+            finally:
+                pool, self.db = self.db, None
+                await pool.close()
+
+    def pool_info(self):
+        stats = dict(self.acquire_stats)
+        stats["size"] = self.db.get_size() if self.db else 0
+        stats["idle"] = self.db.get_idle_size() if self.db else 0
+        return stats
+
+    async def _run(self, method: str, name: str, *args):
+        """Runs a registered query with one of execute, fetch, fetchrow or fetchval"""
+        start = time.perf_counter()
         async with self.db.acquire() as conn:
+            acquired = time.perf_counter()
+            wait = (acquired - start) * 1000
+            self.acquire_stats["acquires"] += 1
+            self.acquire_stats["total_wait_ms"] += wait
+            self.acquire_stats["max_wait_ms"] = max(self.acquire_stats["max_wait_ms"], wait)
+            self.bot.metrics.observe("db_acquire_seconds", acquired - start)
+            with self.bot.metrics.time("db_query_seconds", query=name):
+                return await getattr(conn, method)(QUERIES[name], *args)
+
+    def _priority_queue(self, message_id, absolute, value):
+        """Coalesces a priority write with whatever is already pending for the message"""
+        pending = self.pending_priorities.get(message_id)
+        if pending and not absolute:
+            # an increment on top of a pending write keeps the pending write's kind
+            self.pending_priorities[message_id] = (pending[0], pending[1] + value)
+        else:
+            self.pending_priorities[message_id] = (absolute, value)
+
+    async def priority_flush_loop(self):
+        while self.flush_interval > 0:
+            await asyncio.sleep(self.flush_interval)
             try:
-                with open("schema.sql", 'r') as schema:
-                    try:
-                        await conn.execute(schema.read())
-                    except asyncpg.PostgresError as e:
-                        console_logger.exception(
-                            "A SQL error has occurred while running the schema, traceback is:\n{}".format("".join(
-                                format_exception(type(e), e, e.__traceback__))))
-                        print(format_exception(type(e), e, e.__traceback__))
-                        sys.exit(-1)
-
-            except FileNotFoundError:
-                print(
-                    "schema file not found, please check your files, remember to rename schema.sql.example to schema.sql when you would like to use it")
-                sys.exit(-1)
+                await self.priority_flush()
+            except Exception as e:
+                console_logger.exception(
+                    "Failed to flush priority updates:\n{}".format("".join(format_exception(type(e), e, e.__traceback__))))
+
+    async def priority_flush(self):
+        """Writes every pending priority update in a single statement"""
+        async with self.flush_lock:
+            await self._priority_flush()
+
+    async def _priority_flush(self):
+        if not self.pending_priorities:
+            return
+        batch, self.pending_priorities = self.pending_priorities, {}
+        start = time.perf_counter()
+        try:
+            await self._run(
+                "execute", "priority_flush",
+                list(batch.keys()), [b[0] for b in batch.values()], [b[1] for b in batch.values()])
+        except BaseException:
+            # requeue underneath anything that arrived while the flush was running
+            newer, self.pending_priorities = self.pending_priorities, {}
+            for message_id, (absolute, value) in batch.items():
+                self._priority_queue(message_id, absolute, value)
+            for message_id, (absolute, value) in newer.items():
+                self._priority_queue(message_id, absolute, value)
+            raise
+        latency = (time.perf_counter() - start) * 1000
+        self.flush_stats["flushes"] += 1
+        self.flush_stats["rows"] += len(batch)
+        self.flush_stats["last_size"] = len(batch)
+        self.flush_stats["last_latency_ms"] = latency
+        self.flush_stats["max_latency_ms"] = max(self.flush_stats["max_latency_ms"], latency)
+        console_logger.debug(f"Flushed {len(batch)} priority updates in {latency:.2f}ms")
+
+    async def guild_cache_load(self):
+        """Preloads the settings of every guild into the cache"""
+        rows = await self._run("fetch", "guild_get_every")
+        self.guild_cache = {r['guild_id']: {k: v for k, v in r.items() if k != 'guild_id'} for r in rows}
+        console_logger.info(f"Loaded settings for {len(self.guild_cache)} guilds into the cache")
+
+    def cache_info(self):
+        return {"size": len(self.guild_cache), "hits": self.cache_hits, "misses": self.cache_misses}
+
+    async def _guild_settings(self, guild_id):
+        """Returns the cached settings of a guild, querying the database on a miss"""
+        if guild_id in self.guild_cache:
+            self.cache_hits += 1
+            return self.guild_cache[guild_id]
+        self.cache_misses += 1
+        row = await self._run("fetchrow", "guild_get_all", guild_id)
+        self.guild_cache[guild_id] = dict(row) if row else None
+        return self.guild_cache[guild_id]
+
+    def _guild_cache_set(self, guild_id, row):
+        self.guild_cache[guild_id] = dict(row) if row else None
 
     async def message_update(self, message_id, count):
-        await self.db.execute("UPDATE todo SET priority_level = $1 WHERE message_id = $2", count, message_id)
+        self.bot.dispatch("topic_priorities", {message_id: (True, count)})
+        if self.flush_interval > 0:
+            return self._priority_queue(message_id, True, count)
+        await self._run("execute", "message_update", count, message_id)
 
-    async def message_add(self, guild_id, title, message, message_id):
-        await self.db.execute(
-            "INSERT INTO todo (guild_id, title, message, priority_level, message_id) VALUES ($1, $2, $3, $4, $5)",
-            guild_id, title, message, 1, message_id)
+    async def message_increment(self, message_id, delta):
+        self.bot.dispatch("topic_priorities", {message_id: (False, delta)})
+        if self.flush_interval > 0:
+            return self._priority_queue(message_id, False, delta)
+        await self._run("execute", "message_increment", delta, message_id)
 
-    async def message_get_all(self, guild_id):
-        return await self.db.fetch(
-            "SELECT id, title, message, priority_level, message_id FROM todo WHERE guild_id = $1 ORDER BY priority_level DESC",
-            guild_id)
+    async def message_update_many(self, counts):
+        """Sets the priority of many messages at once, counts maps message_id to priority"""
+        self.bot.dispatch("topic_priorities", {message_id: (True, count) for message_id, count in counts.items()})
+        if self.flush_interval > 0:
+            # queued like single updates, so they replace pending increments instead of having them added on top
+            for message_id, count in counts.items():
+                self._priority_queue(message_id, True, count)
+            return
+        await self._run("execute", "message_update_many", list(counts.keys()), list(counts.values()))
 
-    async def message_get_by_message(self, message_id):
-        return await self.db.fetchrow("SELECT id, title, message, priority_level, message_id FROM todo WHERE message_id = $1", message_id)
+    async def message_get_ranking(self, guild_id):
+        """Gets every open topic of a guild, without the message body"""
+        return await self._run("fetch", "message_get_ranking", guild_id)
+
+    async def message_get_priorities(self, guild_id):
+        return await self._run("fetch", "message_get_priorities", guild_id)
+
+    async def message_reserve_id(self):
+        """Reserves the id of the next topic, to be passed to message_add"""
+        return await self._run("fetchval", "message_reserve_id")
+
+    async def message_add(self, guild_id, title, message, message_id, id):
+        await self._run(
+            "execute", "message_add", id, guild_id, title, message, 1, message_id)
+        self.bot.dispatch("topic_add", guild_id, {"id": id, "title": title[:21], "priority_level": 1, "message_id": message_id})
+
+    async def message_get_page(self, guild_id, after=None, limit=10):
+        """Gets a page of open topics, ordered by priority. after is the (priority_level, id) of the last row of the previous page"""
+        if after is None:
+            return await self._run("fetch", "message_get_first_page", guild_id, limit)
+        return await self._run("fetch", "message_get_page", guild_id, after[0], after[1], limit)
 
     async def message_get_by_id(self, id):
-        return await self.db.fetchrow("SELECT id, title, message, priority_level, message_id FROM todo WHERE id = $1", id)
+        return await self._run("fetchrow", "message_get_by_id", id)
+
+    async def message_archive(self, id, outcome, reason, closed_by):
+        """Moves a topic to the archive with how it was closed"""
+        # the archived priority must include buffered votes, which would otherwise flush into the deleted row
+        await self.priority_flush()
+        await self._run("execute", "message_archive", id, outcome, reason, closed_by)
+        self.bot.dispatch("topic_close", id)
 
-    async def message_remove(self, message_id):
-        await self.db.execute("DELETE FROM todo WHERE id = $1", message_id)
+    async def message_get_by_ids(self, guild_id, ids):
+        return await self._run("fetch", "message_get_by_ids", guild_id, ids)
+
+    async def message_archive_many(self, guild_id, ids, outcome, reason, closed_by):
+        """Archives many topics of a guild at once, returning the ids that were closed"""
+        await self.priority_flush()
+        rows = await self._run("fetch", "message_archive_many", guild_id, ids, outcome, reason, closed_by)
+        for row in rows:
+            self.bot.dispatch("topic_close", row['id'])
+        return [row['id'] for row in rows]
+
+    async def message_search(self, guild_id, query, limit=10, offset=0):
+        """Full text search over the title and message of open and closed topics, best matches first"""
+        return await self._run("fetch", "message_search", guild_id, query, limit, offset)
+
+    async def state_get(self, key):
+        return await self._run("fetchval", "state_get", key)
+
+    async def state_set(self, key, value):
+        await self._run("execute", "state_set", key, value)
+
+    async def guild_export(self, guild_id, table, fmt, output):
+        """Streams a guild's rows of an export table into output, returns the row count"""
+        # buffered priority writes would otherwise be missing from the export
+        await self.priority_flush()
+        async with self.db.acquire() as conn:
+            with self.bot.metrics.time("db_query_seconds", query=f"export_{table}"):
+                return await export_table(conn, guild_id, table, fmt, output)
+
+    async def guild_import(self, guild_id, table, records):
+        """Bulk loads records into a guild's rows of an export table, returns (rows read, rows written)"""
+        await self.priority_flush()
+        async with self.db.acquire() as conn:
+            with self.bot.metrics.time("db_query_seconds", query=f"import_{table}"):
+                result = await import_table(conn, guild_id, table, records)
+        # our own settings notification is ignored, and imported topics are not in any in-memory ranking yet
+        self.guild_cache.pop(guild_id, None)
+        self.bot.dispatch("settings_invalidated", guild_id)
+        return result
 
     async def guild_add(self, guild_id: int):
         """Checks if a guild is in the settings database"""
-        if not await self.db.fetchval("SELECT guild_id FROM settings WHERE guild_id = $1", guild_id):
-            await self.db.execute("INSERT INTO settings (guild_id) VALUES ($1)", guild_id)
+        if not await self._guild_settings(guild_id):
+            row = await self._run("fetchrow", "guild_add", guild_id)
+            self._guild_cache_set(guild_id, row)
 
     async def guild_get_all(self, guild_id):
-        return await self.db.fetchrow("SELECT output_channel_id, allowed_role_ids FROM settings WHERE guild_id = $1", guild_id)
+        return await self._guild_settings(guild_id)
 
     async def guild_channel_add(self, guild_id, channel_id):
-        await self.db.execute("UPDATE settings SET output_channel_id = $1 WHERE guild_id = $2", channel_id, guild_id)
+        row = await self._run("fetchrow", "guild_channel_add", channel_id, guild_id)
+        self._guild_cache_set(guild_id, row)
 
     async def guild_channel_get(self, guild_id):
-        return await self.db.fetchval("SELECT output_channel_id FROM settings WHERE guild_id = $1", guild_id)
+        settings = await self._guild_settings(guild_id)
+        return settings['output_channel_id'] if settings else None
 
     async def guild_channel_remove(self, guild_id):
-        await self.db.execute("UPDATE settings SET output_channel_id = NULL WHERE guild_id = $1", guild_id)
+        row = await self._run("fetchrow", "guild_channel_remove", guild_id)
+        self._guild_cache_set(guild_id, row)
+
+    async def guild_board_get(self, guild_id):
+        settings = await self._guild_settings(guild_id)
+        return settings.get('board_message_id') if settings else None
+
+    async def guild_board_set(self, guild_id, message_id):
+        row = await self._run("fetchrow", "guild_board_set", message_id, guild_id)
+        self._guild_cache_set(guild_id, row)
+
+    def guild_get_boards(self):
+        """Returns the guilds that have a priority board, from the cache"""
+        return [guild_id for guild_id, settings in self.guild_cache.items() if settings and settings.get('board_message_id')]
 
     async def guild_role_get(self, guild_id):
-        return await self.db.fetchval("SELECT allowed_role_ids FROM settings WHERE guild_id = $1", guild_id)
+        settings = await self._guild_settings(guild_id)
+        return settings['allowed_role_ids'] if settings else None
 
     async def guild_role_add(self, guild_id, role_id):
-        await self.db.execute(
-            "UPDATE settings SET allowed_role_ids = array_append(allowed_role_ids, $1::BIGINT) WHERE guild_id = $2", role_id, guild_id)
+        row = await self._run("fetchrow", "guild_role_add", role_id, guild_id)
+        self._guild_cache_set(guild_id, row)
 
     async def guild_role_remove(self, guild_id, role_id):
-        await self.db.execute(
-            "UPDATE settings SET allowed_role_ids = array_remove(allowed_role_ids, $1) WHERE guild_id = $2", role_id, guild_id)
+        row = await self._run("fetchrow", "guild_role_remove", role_id, guild_id)
+        self._guild_cache_set(guild_id, row)
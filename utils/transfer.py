@@ -0,0 +1,113 @@
+#
+# SPDX-License-Identifier: MIT
+#
+
+
+import csv
+import json
+from datetime import datetime
+
+import asyncpg
+
+
+# export name -> (table, columns). Generated columns are left out, they are rebuilt on import.
+TABLES = {
+    "topics": ("todo", ("id", "guild_id", "title", "message", "priority_level", "message_id")),
+    "archive": ("todo_archive", ("id", "guild_id", "title", "message", "priority_level", "message_id",
+                                 "outcome", "reason", "closed_by", "closed_at")),
+    "settings": ("settings", ("guild_id", "output_channel_id", "allowed_role_ids", "board_message_id")),
+}
+FORMATS = ("csv", "jsonl")
+
+_INT_COLUMNS = {"id", "guild_id", "priority_level", "message_id", "closed_by", "output_channel_id", "board_message_id"}
+# Topic ids are shared by open and closed topics, an imported topic must not reuse an id from the other table
+_OTHER_TOPIC_TABLE = {"todo": "todo_archive", "todo_archive": "todo"}
+
+
+def _convert(column, value, from_csv):
+    # CSV cannot tell NULL from an empty string, topic text keeps the empty string and everything else is NULL
+    if from_csv and value == "" and column not in ("title", "message"):
+        return None
+    if value is None:
+        return None
+    if column in _INT_COLUMNS:
+        return int(value)
+    if column == "allowed_role_ids":
+        if from_csv:
+            # Postgres array literal, like {1,2}
+            return [int(v) for v in value.strip("{}").split(",") if v]
+        return [int(v) for v in value]
+    if column == "closed_at":
+        return datetime.fromisoformat(value)
+    return value
+
+
+def read_records(fp, table: str, fmt: str):
+    """Yields rows of an export file as tuples in TABLES column order, one line at a time"""
+    columns = TABLES[table][1]
+    if fmt == "csv":
+        reader = csv.reader(fp)
+        header = next(reader, [])
+        missing = [c for c in columns if c not in header]
+        if missing:
+            raise ValueError(f"missing columns: {', '.join(missing)}")
+        index = [header.index(c) for c in columns]
+        for row in reader:
+            yield tuple(_convert(c, row[i], True) for c, i in zip(columns, index))
+    else:
+        for line in fp:
+            if line.strip():
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError(f"expected a JSON object per line, got {type(data).__name__}")
+                yield tuple(_convert(c, data.get(c), False) for c in columns)
+
+
+async def export_table(conn: asyncpg.Connection, guild_id: int, table: str, fmt: str, output) -> int:
+    """Streams a guild's rows into output (a path, binary file or coroutine function) with COPY, returns the row count"""
+    name, columns = TABLES[table]
+    select = f"SELECT {', '.join(columns)} FROM {name} WHERE guild_id = $1 ORDER BY 1"
+    if fmt == "csv":
+        status = await conn.copy_from_query(select, guild_id, output=output, format="csv", header=True)
+    else:
+        # JSON never contains raw control characters, so using them as quote and delimiter leaves every line as is
+        status = await conn.copy_from_query(f"SELECT row_to_json(t)::TEXT FROM ({select}) AS t", guild_id,
+                                            output=output, format="csv", quote="\x01", delimiter="\x02")
+    return int(status.split()[-1])
+
+
+async def import_table(conn: asyncpg.Connection, guild_id: int, table: str, records) -> tuple:
+    """Bulk loads records into a guild's rows with COPY, in one transaction.
+
+    Every row is assigned to guild_id. Topics whose id is already taken are skipped, settings are overwritten
+    except for the board message, which stays the target guild's own.
+    Returns (rows read, rows written).
+    """
+    name, columns = TABLES[table]
+    guild_index = columns.index("guild_id")
+    records = (r[:guild_index] + (guild_id,) + r[guild_index + 1:] for r in records)
+    column_list = ", ".join(columns)
+
+    async with conn.transaction():
+        await conn.execute(f"CREATE TEMP TABLE import_rows (LIKE {name} INCLUDING DEFAULTS) ON COMMIT DROP")
+        status = await conn.copy_records_to_table("import_rows", records=records, columns=columns)
+        read = int(status.split()[-1])
+        if name == "settings":
+            # the board message belongs to the exporting guild, the target keeps its own
+            kept = [c for c in columns if c != "board_message_id"]
+            updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in kept if c != "guild_id")
+            column_list = ", ".join(kept)
+            status = await conn.execute(
+                f"INSERT INTO settings ({column_list}) SELECT {column_list} FROM import_rows "
+                f"ON CONFLICT (guild_id) DO UPDATE SET {updates}")
+        else:
+            status = await conn.execute(
+                f"INSERT INTO {name} ({column_list}) SELECT {column_list} FROM import_rows "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {_OTHER_TOPIC_TABLE[name]} AS other WHERE other.id = import_rows.id) "
+                f"ON CONFLICT DO NOTHING")
+            # imported ids must not be handed out again by message_reserve_id
+            await conn.execute(
+                "SELECT setval(pg_get_serial_sequence('todo', 'id'), GREATEST("
+                "(SELECT COALESCE(max(id), 0) FROM todo), (SELECT COALESCE(max(id), 0) FROM todo_archive), 1))")
+        written = int(status.split()[-1])
+    return read, written